@@ -3,12 +3,60 @@ GitHub Gists API Server
 A simple Flask web server that fetches and returns a user's public GitHub Gists.
 """
 
-import requests
+import msgspec
+import orjson
+import redis
+import urllib3
 from flask import Flask, jsonify, request
-from functools import lru_cache
+from flask.json.provider import JSONProvider
+from cachetools import LRUCache, TTLCache
+from concurrent.futures import Future
+from threading import BoundedSemaphore, Lock
+import hashlib
 import logging
+import os
+import re
+import time
+
+
+class ORJSONProvider(JSONProvider):
+    """JSON provider that uses orjson for encoding and decoding."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
+
+
+class Gist(msgspec.Struct):
+    """The fields of a GitHub gist that are read from the API response."""
+    id: str | None = None
+    description: str | None = 'No description'
+    public: bool = True
+    files: dict[str, msgspec.Raw] = {}
+    html_url: str | None = None
+    created_at: str | None = None
+    updated_at: str | None = None
+
+
+class GistSummary(msgspec.Struct):
+    """Simplified gist returned by the API."""
+    id: str | None
+    description: str | None
+    public: bool
+    files: list[str]
+    url: str | None
+    created_at: str | None
+    updated_at: str | None
+
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,10 +65,93 @@ logger = logging.getLogger(__name__)
 # GitHub API configuration
 GITHUB_API_BASE_URL = "https://api.github.com"
 GITHUB_API_TIMEOUT = 10  # seconds
+GITHUB_MAX_CONCURRENCY = 64  # concurrent requests to api.github.com
+
+# Query parameter values accepted as integers: optional minus sign and at
+# most 9 ASCII digits, so int() never sees '1_0', '+5', ' 5 ' or a string
+# longer than it will convert
+_INT_PATTERN = re.compile(r'-?[0-9]{1,9}')
+
+# Decodes only the Gist fields; everything else GitHub sends is skipped
+_GISTS_DECODER = msgspec.json.Decoder(list[Gist])
+_ENCODER = msgspec.json.Encoder()
+
+# Cache configuration: successful responses are cached for a short time,
+# failed lookups (unknown user, rate limit, GitHub errors) for even less.
+# Successful responses vary a lot in size, so they are bounded by the total
+# size of the cached bodies rather than the number of entries.
+# CACHE_MAX_BYTES is the budget for all cached bodies: half goes to fresh
+# responses and half to ETag validators (see below). Failed lookups are
+# small error bodies and only bounded by count.
+CACHE_TTL = 60  # seconds
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+NEGATIVE_CACHE_TTL = 10  # seconds
+_POS = TTLCache(maxsize=CACHE_MAX_BYTES // 2, ttl=CACHE_TTL, getsizeof=lambda v: len(v[0]))
+_NEG = TTLCache(maxsize=1024, ttl=NEGATIVE_CACHE_TTL)
+# ETag, body and gist count of the last successful GitHub response for each
+# key, kept past CACHE_TTL so expired entries can be revalidated with a
+# conditional request instead of being downloaded and re-encoded. The body
+# has to be kept here since the _POS entry is gone by the time it's needed.
+_VALIDATORS = LRUCache(maxsize=CACHE_MAX_BYTES // 2, getsizeof=lambda v: len(v[1]))
+_CACHE_LOCK = Lock()
+# Futures for the cache misses currently being loaded, so concurrent
+# requests for the same key wait for one GitHub call instead of each
+# making their own
+_INFLIGHT = {}
+
+# Optional Redis cache shared by all workers, enabled by setting REDIS_URL
+REDIS_URL = os.environ.get('REDIS_URL')
+R = redis.Redis(
+    connection_pool=redis.BlockingConnectionPool.from_url(REDIS_URL, max_connections=32)
+) if REDIS_URL else None
+
+# Shared connection pool so connections to the GitHub API are kept alive
+# and reused across requests instead of re-doing the TCP/TLS handshake.
+# Responses are requested compressed (gzip, deflate, and br when brotli is
+# installed) and decompressed by urllib3.
+HTTP = urllib3.PoolManager(
+    num_pools=4,
+    maxsize=GITHUB_MAX_CONCURRENCY,
+    headers={
+        'Accept-Encoding': urllib3.make_headers(accept_encoding=True)['accept-encoding'],
+        'Accept': 'application/vnd.github+json',
+        'User-Agent': 'gists-api'
+    },
+    retries=urllib3.Retry(
+        total=3,
+        backoff_factor=0.3,
+        backoff_max=8,
+        status_forcelist=(500, 502, 503, 504),
+        raise_on_status=False,
+        # Retry-After is recorded by _update_rate_limit instead; sleeping on
+        # it here would block the request (GitHub sends up to 60s)
+        respect_retry_after_header=False
+    ),
+    timeout=urllib3.Timeout(total=GITHUB_API_TIMEOUT)
+)
 
+# Caps in-flight GitHub requests at the connection pool size so request
+# threads wait for a pooled connection instead of opening extra ones
+GITHUB_SEM = BoundedSemaphore(GITHUB_MAX_CONCURRENCY)
 
-@lru_cache(maxsize=128)
-def fetch_user_gists(username, per_page=30, page=1):
+# Epoch time until which GitHub calls are skipped because the rate limit
+# is exhausted
+_rate_limit_reset = 0.0
+
+
+def _update_rate_limit(response):
+    """Record when the rate limit resets if a GitHub response exhausted it."""
+    global _rate_limit_reset
+    retry_after = response.headers.get('Retry-After', '')
+    if response.status in (403, 429) and retry_after.isdigit():
+        _rate_limit_reset = time.time() + int(retry_after)
+    elif response.headers.get('X-RateLimit-Remaining') == '0':
+        reset = response.headers.get('X-RateLimit-Reset', '')
+        if reset.isdigit():
+            _rate_limit_reset = float(reset)
+
+
+def fetch_user_gists(username, per_page=30, page=1, etag=None):
     """
     Fetch public gists for a given GitHub user.
     
@@ -28,53 +159,233 @@ def fetch_user_gists(username, per_page=30, page=1):
         username: GitHub username
         per_page: Number of results per page (max 100)
         page: Page number for pagination
+        etag: ETag of a previous response; if the gists haven't changed
+            GitHub answers 304 and no gists are returned
     
     Returns:
-        Tuple of (gists_list, error_message)
+        Tuple of (gists_list, error_message, status_code, etag), where
+        status_code is the GitHub response status or None if the request
+        itself failed
     """
+    if time.time() < _rate_limit_reset:
+        return None, "GitHub API rate limit exceeded", None, None
+    
     try:
         url = f"{GITHUB_API_BASE_URL}/users/{username}/gists"
-        params = {
+        fields = {
             'per_page': min(per_page, 100),
             'page': page
         }
         
         logger.info(f"Fetching gists for user: {username}, page: {page}")
         
-        response = requests.get(url, params=params, timeout=GITHUB_API_TIMEOUT)
+        # Passing headers replaces the pool defaults, so merge them in
+        headers = {**HTTP.headers, 'If-None-Match': etag} if etag else None
+        
+        with GITHUB_SEM:
+            response = HTTP.request('GET', url, fields=fields, headers=headers)
+        _update_rate_limit(response)
+        logger.debug(f"GitHub response encoding: {response.headers.get('Content-Encoding')}")
         
-        if response.status_code == 404:
-            return None, f"User '{username}' not found"
-        elif response.status_code == 403:
-            return None, "GitHub API rate limit exceeded"
-        elif response.status_code != 200:
-            return None, f"GitHub API error: {response.status_code}"
+        if response.status == 304:
+            return None, None, 304, etag
+        elif response.status == 404:
+            return None, f"User '{username}' not found", 404, None
+        elif response.status in (403, 429):
+            return None, "GitHub API rate limit exceeded", response.status, None
+        elif response.status != 200:
+            return None, f"GitHub API error: {response.status}", response.status, None
         
-        gists = response.json()
+        gists = _GISTS_DECODER.decode(response.data)
         
         # Transform gists data to a simpler format
-        simplified_gists = []
-        for gist in gists:
-            simplified_gists.append({
-                'id': gist.get('id'),
-                'description': gist.get('description', 'No description'),
-                'public': gist.get('public', True),
-                'files': list(gist.get('files', {}).keys()),
-                'url': gist.get('html_url'),
-                'created_at': gist.get('created_at'),
-                'updated_at': gist.get('updated_at')
-            })
+        simplified_gists = [
+            GistSummary(
+                id=gist.id,
+                description=gist.description,
+                public=gist.public,
+                files=list(gist.files),
+                url=gist.html_url,
+                created_at=gist.created_at,
+                updated_at=gist.updated_at
+            )
+            for gist in gists
+        ]
         
-        return simplified_gists, None
+        return simplified_gists, None, 200, response.headers.get('ETag')
         
-    except requests.exceptions.Timeout:
-        return None, "Request to GitHub API timed out"
-    except requests.exceptions.RequestException as e:
+    except urllib3.exceptions.HTTPError as e:
+        # Timeouts surface as MaxRetryError once retries are used up
+        if isinstance(e, urllib3.exceptions.TimeoutError) or \
+                isinstance(getattr(e, 'reason', None), urllib3.exceptions.TimeoutError):
+            return None, "Request to GitHub API timed out", None, None
         logger.error(f"Error fetching gists: {str(e)}")
-        return None, f"Error connecting to GitHub API: {str(e)}"
+        return None, f"Error connecting to GitHub API: {str(e)}", None, None
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
-        return None, f"Internal server error: {str(e)}"
+        return None, f"Internal server error: {str(e)}", None, None
+
+
+def cache_clear():
+    """Clear the cached gist responses, failed lookups and rate limit state."""
+    global _rate_limit_reset
+    _rate_limit_reset = 0.0
+    with _CACHE_LOCK:
+        _POS.clear()
+        _NEG.clear()
+        _VALIDATORS.clear()
+
+
+def _redis_get(key):
+    """
+    Look up a cached response body or error in the shared Redis cache.
+    
+    Returns:
+        Tuple of (body_bytes, gist_count, error_message), all None on a
+        miss or if Redis is not configured or unavailable
+    """
+    if R is None:
+        return None, None, None
+    try:
+        body, count, error = R.mget(key, f"{key}:count", f"{key}:err")
+    except redis.RedisError as e:
+        logger.warning(f"Redis cache lookup failed: {str(e)}")
+        return None, None, None
+    if error is not None:
+        return None, None, error.decode()
+    if body is None or count is None:
+        return None, None, None
+    return body, int(count), None
+
+
+def _redis_set(key, body=None, count=None, error=None):
+    """Store a response body and its gist count, or an error, in Redis."""
+    if R is None:
+        return
+    try:
+        if error is not None:
+            R.setex(f"{key}:err", NEGATIVE_CACHE_TTL, error)
+        else:
+            pipe = R.pipeline()
+            pipe.setex(key, CACHE_TTL, body)
+            pipe.setex(f"{key}:count", CACHE_TTL, count)
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Redis cache update failed: {str(e)}")
+
+
+def _error_status(error):
+    """Map an error message to the HTTP status code returned to the client."""
+    if "rate limit" in error.lower():
+        return 429
+    if "not found" in error.lower():
+        return 404
+    return 500
+
+
+def _load_response(username, per_page, page):
+    """
+    Load a response that isn't in the in-process cache and cache it.
+    
+    Redis is checked first, when configured, before calling GitHub.
+    Expired responses are revalidated with their ETag. Errors returned by
+    GitHub are cached separately with a shorter TTL so repeated requests
+    for a bad username don't use up the rate limit.
+    
+    Returns:
+        Tuple of (body_bytes, status_code, headers)
+    """
+    key = (username, per_page, page)
+    redis_key = f"gh:{username}:{per_page}:{page}"
+    body, count, error = _redis_get(redis_key)
+    if body is None and error is None:
+        with _CACHE_LOCK:
+            validator = _VALIDATORS.get(key)
+        gists, error, status_code, etag = fetch_user_gists(
+            username, per_page, page, etag=validator[0] if validator else None
+        )
+        if error:
+            # Only cache errors GitHub actually responded with, not timeouts
+            # or connection failures
+            if status_code is None:
+                return orjson.dumps({'error': error}), _error_status(error), {}
+            _redis_set(redis_key, error=error)
+        else:
+            if status_code == 304:
+                # Unchanged since the last fetch, reuse the encoded body
+                _, body, count = validator
+            else:
+                count = len(gists)
+                body = _ENCODER.encode({
+                    'username': username,
+                    'gists': gists,
+                    'count': count,
+                    'page': page,
+                    'per_page': per_page
+                })
+                if etag:
+                    with _CACHE_LOCK:
+                        _VALIDATORS[key] = (etag, body, count)
+            _redis_set(redis_key, body=body, count=count)
+    
+    if error:
+        result = orjson.dumps({'error': error}), _error_status(error), {}
+        with _CACHE_LOCK:
+            _NEG[key] = result
+    else:
+        # The count is also sent as a header so clients don't need to
+        # parse the body for it. The ETag and Cache-Control headers let
+        # clients and proxies (nginx, CDNs) cache and revalidate responses.
+        result = body, 200, {
+            'X-Result-Count': str(count),
+            'ETag': f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"',
+            'Cache-Control': f'public, max-age={CACHE_TTL}',
+            'Vary': 'Accept-Encoding'
+        }
+        with _CACHE_LOCK:
+            _POS[key] = result
+    return result
+
+
+def _fetch_bytes(username, per_page=30, page=1):
+    """
+    Fetch public gists for a user and encode the response body.
+    
+    The encoded body and status code are what gets cached, so cache hits
+    are served as-is without re-encoding anything. On a miss only one
+    request per key loads the response; concurrent requests for the same
+    key wait for its result.
+    
+    Returns:
+        Tuple of (body_bytes, status_code, headers)
+    """
+    key = (username, per_page, page)
+    with _CACHE_LOCK:
+        cached = _POS.get(key) or _NEG.get(key)
+        if cached is not None:
+            return cached
+        future = _INFLIGHT.get(key)
+        if future is None:
+            future = _INFLIGHT[key] = Future()
+            loading = True
+        else:
+            loading = False
+    
+    if not loading:
+        return future.result()
+    
+    try:
+        result = _load_response(username, per_page, page)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        # Also covers gevent.Timeout and GreenletExit, which would otherwise
+        # leave the waiters on this future blocked forever
+        future.set_exception(e)
+        raise
+    finally:
+        with _CACHE_LOCK:
+            del _INFLIGHT[key]
 
 
 @app.route('/<username>', methods=['GET'])
@@ -86,9 +397,15 @@ def get_user_gists(username):
         - per_page: Number of results per page (default: 30, max: 100)
         - page: Page number (default: 1)
     """
-    # Get pagination parameters from query string
-    per_page = request.args.get('per_page', default=30, type=int)
-    page = request.args.get('page', default=1, type=int)
+    # Get pagination parameters from query string. Values that aren't
+    # plain integers are rejected rather than silently replaced by the
+    # defaults.
+    per_page = request.args.get('per_page', '30')
+    page = request.args.get('page', '1')
+    if not (_INT_PATTERN.fullmatch(per_page) and _INT_PATTERN.fullmatch(page)):
+        return jsonify({'error': 'per_page and page must be integers'}), 400
+    per_page = int(per_page)
+    page = int(page)
     
     # Validate parameters
     if per_page < 1 or per_page > 100:
@@ -97,49 +414,52 @@ def get_user_gists(username):
         return jsonify({'error': 'page must be greater than 0'}), 400
     
     # Fetch gists
-    gists, error = fetch_user_gists(username, per_page, page)
-    
-    if error:
-        status_code = 404 if "not found" in error.lower() else 500
-        if "rate limit" in error.lower():
-            status_code = 429
-        return jsonify({'error': error}), status_code
+    body, status_code, headers = _fetch_bytes(username, per_page, page)
     
-    return jsonify({
-        'username': username,
-        'gists': gists,
-        'count': len(gists),
-        'page': page,
-        'per_page': per_page
-    })
+    response = app.response_class(
+        body, status=status_code, headers=headers, mimetype='application/json'
+    )
+    # Answers 304 Not Modified if the client's If-None-Match matches. Error
+    # responses carry no ETag and must not be turned into 304 or 412.
+    if status_code == 200:
+        return response.make_conditional(request)
+    return response
+
+
+# Bodies of the static endpoints, encoded once at import time
+_HEALTH_BODY = orjson.dumps({'status': 'healthy'})
+_ROOT_BODY = orjson.dumps({
+    'message': 'GitHub Gists API',
+    'usage': 'GET /<username> to retrieve public gists for a user',
+    'example': '/octocat',
+    'query_parameters': {
+        'per_page': 'Number of results per page (default: 30, max: 100)',
+        'page': 'Page number (default: 1)'
+    },
+    'endpoints': {
+        '/': 'API information',
+        '/<username>': 'Get user gists',
+        '/health': 'Health check'
+    }
+})
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
-    return jsonify({'status': 'healthy'}), 200
+    return app.response_class(_HEALTH_BODY, mimetype='application/json')
 
 
 @app.route('/', methods=['GET'])
 def root():
     """Root endpoint with API information."""
-    return jsonify({
-        'message': 'GitHub Gists API',
-        'usage': 'GET /<username> to retrieve public gists for a user',
-        'example': '/octocat',
-        'query_parameters': {
-            'per_page': 'Number of results per page (default: 30, max: 100)',
-            'page': 'Page number (default: 1)'
-        },
-        'endpoints': {
-            '/': 'API information',
-            '/<username>': 'Get user gists',
-            '/health': 'Health check'
-        }
-    })
+    response = app.response_class(_ROOT_BODY, mimetype='application/json')
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
 
 
 if __name__ == '__main__':
-    # Run the server on port 8080
-    app.run(host='0.0.0.0', port=8080, debug=False)
+    # Run the development server on port 8080; in production the app is
+    # served by gunicorn through wsgi.py
+    app.run(host='0.0.0.0', port=8080, debug=False, threaded=True)
 
@@ -4,8 +4,13 @@ Automated tests for the GitHub Gists API server.
 
 import pytest
 import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import patch, MagicMock
-from app import app, fetch_user_gists
+from cachetools import TTLCache
+import app as app_module
+from app import app, cache_clear, _fetch_bytes
 
 
 @pytest.fixture
@@ -38,18 +43,20 @@ class TestRootEndpoint:
         assert 'message' in data
         assert 'usage' in data
         assert 'endpoints' in data
+        assert response.headers['Cache-Control'] == 'public, max-age=3600'
 
 
 class TestUserGistsEndpoint:
     """Tests for the user gists endpoint."""
     
-    @patch('app.requests.get')
+    @patch('app.HTTP.request')
     def test_successful_gists_fetch(self, mock_get, client):
         """Test successful fetching of user gists."""
         # Mock GitHub API response
         mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = [
+        mock_response.status = 200
+        mock_response.headers = {}
+        mock_response.data = json.dumps([
             {
                 'id': 'abc123',
                 'description': 'Test gist',
@@ -61,11 +68,11 @@ class TestUserGistsEndpoint:
                 'created_at': '2023-01-01T00:00:00Z',
                 'updated_at': '2023-01-02T00:00:00Z'
             }
-        ]
+        ]).encode()
         mock_get.return_value = mock_response
         
         # Clear cache before test
-        fetch_user_gists.cache_clear()
+        cache_clear()
         
         response = client.get('/testuser')
         assert response.status_code == 200
@@ -77,16 +84,18 @@ class TestUserGistsEndpoint:
         assert data['gists'][0]['id'] == 'abc123'
         assert data['gists'][0]['description'] == 'Test gist'
         assert data['count'] == 1
+        assert response.headers['X-Result-Count'] == '1'
     
-    @patch('app.requests.get')
+    @patch('app.HTTP.request')
     def test_user_not_found(self, mock_get, client):
         """Test handling of non-existent user."""
         mock_response = MagicMock()
-        mock_response.status_code = 404
+        mock_response.status = 404
+        mock_response.headers = {}
         mock_get.return_value = mock_response
         
         # Clear cache before test
-        fetch_user_gists.cache_clear()
+        cache_clear()
         
         response = client.get('/nonexistentuser123456')
         assert response.status_code == 404
@@ -94,16 +103,23 @@ class TestUserGistsEndpoint:
         data = json.loads(response.data)
         assert 'error' in data
         assert 'not found' in data['error'].lower()
+        
+        # Conditional headers don't apply to error responses
+        response = client.get('/nonexistentuser123456', headers={'If-None-Match': '*'})
+        assert response.status_code == 404
+        response = client.get('/nonexistentuser123456', headers={'If-Match': '"abc"'})
+        assert response.status_code == 404
     
-    @patch('app.requests.get')
+    @patch('app.HTTP.request')
     def test_rate_limit_exceeded(self, mock_get, client):
         """Test handling of GitHub API rate limit."""
         mock_response = MagicMock()
-        mock_response.status_code = 403
+        mock_response.status = 403
+        mock_response.headers = {}
         mock_get.return_value = mock_response
         
         # Clear cache before test
-        fetch_user_gists.cache_clear()
+        cache_clear()
         
         response = client.get('/testuser')
         assert response.status_code == 429
@@ -112,13 +128,86 @@ class TestUserGistsEndpoint:
         assert 'error' in data
         assert 'rate limit' in data['error'].lower()
     
-    @patch('app.requests.get')
+    @patch('app.HTTP.request')
+    def test_rate_limit_reset_respected(self, mock_get, client):
+        """Test that GitHub is not called again until the rate limit resets."""
+        mock_response = MagicMock()
+        mock_response.status = 403
+        mock_response.headers = {
+            'X-RateLimit-Remaining': '0',
+            'X-RateLimit-Reset': str(int(time.time()) + 3600)
+        }
+        mock_get.return_value = mock_response
+        
+        # Clear cache before test
+        cache_clear()
+        
+        assert client.get('/testuser').status_code == 429
+        assert client.get('/otheruser').status_code == 429
+        assert mock_get.call_count == 1
+        
+        cache_clear()
+    
+    @patch('app.HTTP.request')
+    def test_retry_after_respected(self, mock_get, client):
+        """Test that a 403 with Retry-After blocks GitHub calls until it passes."""
+        mock_response = MagicMock()
+        mock_response.status = 403
+        mock_response.headers = {'Retry-After': '60'}
+        mock_get.return_value = mock_response
+        
+        # Clear cache before test
+        cache_clear()
+        
+        assert client.get('/testuser').status_code == 429
+        assert client.get('/otheruser').status_code == 429
+        assert mock_get.call_count == 1
+        
+        cache_clear()
+    
+    def test_retry_after_not_slept_on(self, client):
+        """Test that a 429 with Retry-After is not retried by the HTTP client."""
+        hits = []
+        
+        class RateLimitedHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                hits.append(self.path)
+                self.send_response(429)
+                self.send_header('Retry-After', '3')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            
+            def log_message(self, *args):
+                pass
+        
+        server = ThreadingHTTPServer(('127.0.0.1', 0), RateLimitedHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        
+        # Clear cache before test
+        cache_clear()
+        
+        try:
+            base_url = f"http://127.0.0.1:{server.server_port}"
+            with patch('app.GITHUB_API_BASE_URL', base_url):
+                started = time.monotonic()
+                assert client.get('/testuser').status_code == 429
+                assert time.monotonic() - started < 3
+                assert client.get('/otheruser').status_code == 429
+        finally:
+            server.shutdown()
+            server.server_close()
+            cache_clear()
+        
+        assert len(hits) == 1
+    
+    @patch('app.HTTP.request')
     def test_octocat_user(self, mock_get, client):
         """Test with the example user 'octocat'."""
         # Mock response for octocat user
         mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = [
+        mock_response.status = 200
+        mock_response.headers = {}
+        mock_response.data = json.dumps([
             {
                 'id': 'gist1',
                 'description': 'Octocat gist 1',
@@ -141,11 +230,11 @@ class TestUserGistsEndpoint:
                 'created_at': '2023-02-01T00:00:00Z',
                 'updated_at': '2023-02-02T00:00:00Z'
             }
-        ]
+        ]).encode()
         mock_get.return_value = mock_response
         
         # Clear cache before test
-        fetch_user_gists.cache_clear()
+        cache_clear()
         
         response = client.get('/octocat')
         assert response.status_code == 200
@@ -155,6 +244,207 @@ class TestUserGistsEndpoint:
         assert len(data['gists']) == 2
         assert data['count'] == 2
     
+    @patch('app.HTTP.request')
+    def test_cached_response_reused(self, mock_get, client):
+        """Test that repeated requests are served from the cache."""
+        mock_response = MagicMock()
+        mock_response.status = 200
+        mock_response.headers = {}
+        mock_response.data = b'[]'
+        mock_get.return_value = mock_response
+        
+        # Clear cache before test
+        cache_clear()
+        
+        first = client.get('/testuser')
+        second = client.get('/testuser')
+        assert first.status_code == 200
+        assert second.data == first.data
+        assert mock_get.call_count == 1
+    
+    @patch('app.HTTP.request')
+    def test_conditional_request_not_modified(self, mock_get, client):
+        """Test that a matching If-None-Match gets a 304 response."""
+        mock_response = MagicMock()
+        mock_response.status = 200
+        mock_response.headers = {}
+        mock_response.data = b'[]'
+        mock_get.return_value = mock_response
+        
+        # Clear cache before test
+        cache_clear()
+        
+        response = client.get('/testuser')
+        assert response.status_code == 200
+        assert response.headers['Cache-Control'] == 'public, max-age=60'
+        etag = response.headers['ETag']
+        
+        response = client.get('/testuser', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+    
+    @patch('app.HTTP.request')
+    def test_expired_response_revalidated(self, mock_get, client):
+        """Test that expired responses are revalidated with their ETag."""
+        mock_response = MagicMock()
+        mock_response.status = 200
+        mock_response.headers = {'ETag': '"abc"'}
+        mock_response.data = b'[]'
+        mock_get.return_value = mock_response
+        
+        # Clear cache before test
+        cache_clear()
+        
+        first = client.get('/testuser')
+        
+        # Expire the cached response and have GitHub report no changes
+        app_module._POS.clear()
+        mock_response.status = 304
+        second = client.get('/testuser')
+        
+        assert second.status_code == 200
+        assert second.data == first.data
+        headers = mock_get.call_args.kwargs['headers']
+        assert headers['If-None-Match'] == '"abc"'
+        assert headers['Accept-Encoding'] == app_module.HTTP.headers['Accept-Encoding']
+    
+    @patch('app.HTTP.request')
+    def test_concurrent_requests_coalesced(self, mock_get, client):
+        """Test that concurrent cache misses for a user share one GitHub call."""
+        started = threading.Event()
+        release = threading.Event()
+        mock_response = MagicMock()
+        mock_response.status = 200
+        mock_response.headers = {}
+        mock_response.data = b'[]'
+        
+        def slow_request(*args, **kwargs):
+            started.set()
+            release.wait(5)
+            return mock_response
+        mock_get.side_effect = slow_request
+        
+        # Clear cache before test
+        cache_clear()
+        
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(_fetch_bytes('testuser')))
+            for _ in range(5)
+        ]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        
+        assert mock_get.call_count == 1
+        assert len(results) == 5
+        assert all(result == results[0] for result in results)
+    
+    def test_coalesced_waiters_released_on_base_exception(self):
+        """Test that waiters don't hang if the loading request is interrupted."""
+        started = threading.Event()
+        release = threading.Event()
+        
+        def interrupted_load(*args):
+            started.set()
+            release.wait(5)
+            raise KeyboardInterrupt
+        
+        # Clear cache before test
+        cache_clear()
+        
+        errors = []
+        
+        def fetch():
+            try:
+                _fetch_bytes('testuser')
+            except BaseException as e:
+                errors.append(e)
+        
+        with patch('app._load_response', side_effect=interrupted_load):
+            loader = threading.Thread(target=fetch, daemon=True)
+            loader.start()
+            started.wait(5)
+            waiter = threading.Thread(target=fetch, daemon=True)
+            waiter.start()
+            # Give the waiter time to block on the in-flight future
+            time.sleep(0.1)
+            release.set()
+            loader.join(5)
+            waiter.join(5)
+        
+        assert not waiter.is_alive()
+        assert len(errors) == 2
+        assert all(isinstance(e, KeyboardInterrupt) for e in errors)
+    
+    @patch('app.HTTP.request')
+    def test_response_cache_bounded_by_body_size(self, mock_get, client):
+        """Test that the response cache evicts by total body size."""
+        mock_response = MagicMock()
+        mock_response.status = 200
+        mock_response.headers = {}
+        mock_response.data = b'[]'
+        mock_get.return_value = mock_response
+        
+        # Clear cache before test
+        cache_clear()
+        
+        # Room for one empty-gists body (~70 bytes) but not two
+        small_cache = TTLCache(maxsize=100, ttl=60, getsizeof=app_module._POS.getsizeof)
+        with patch('app._POS', small_cache):
+            first = client.get('/firstuser')
+            second = client.get('/seconduser')
+            
+            assert ('firstuser', 30, 1) not in small_cache
+            assert ('seconduser', 30, 1) in small_cache
+            assert small_cache.currsize == len(second.data)
+            assert len(first.data) + len(second.data) > small_cache.maxsize
+    
+    @patch('app.HTTP.request')
+    def test_not_found_response_cached(self, mock_get, client):
+        """Test that GitHub errors are cached as negative results."""
+        mock_response = MagicMock()
+        mock_response.status = 404
+        mock_response.headers = {}
+        mock_get.return_value = mock_response
+        
+        # Clear cache before test
+        cache_clear()
+        
+        assert client.get('/nonexistentuser123456').status_code == 404
+        assert client.get('/nonexistentuser123456').status_code == 404
+        assert mock_get.call_count == 1
+    
+    @patch('app.HTTP.request')
+    def test_shared_redis_cache_hit(self, mock_get, client):
+        """Test that a body cached in Redis is served without calling GitHub."""
+        body = json.dumps({
+            'username': 'testuser',
+            'gists': [],
+            'count': 0,
+            'page': 1,
+            'per_page': 30
+        }).encode()
+        mock_redis = MagicMock()
+        mock_redis.mget.return_value = [body, b'0', None]
+        
+        # Clear cache before test
+        cache_clear()
+        
+        with patch('app.R', mock_redis):
+            response = client.get('/testuser')
+        assert response.status_code == 200
+        assert response.data == body
+        assert response.headers['X-Result-Count'] == '0'
+        mock_redis.mget.assert_called_once_with(
+            'gh:testuser:30:1', 'gh:testuser:30:1:count', 'gh:testuser:30:1:err'
+        )
+        mock_get.assert_not_called()
+    
     def test_invalid_pagination_parameters(self, client):
         """Test validation of pagination parameters."""
         # Test invalid per_page (too high)
@@ -168,17 +458,33 @@ class TestUserGistsEndpoint:
         # Test invalid page (negative)
         response = client.get('/testuser?page=-1')
         assert response.status_code == 400
+        
+        # Test non-integer values
+        response = client.get('/testuser?per_page=abc')
+        assert response.status_code == 400
+        response = client.get('/testuser?page=1.5')
+        assert response.status_code == 400
+        response = client.get('/testuser?per_page=1_0')
+        assert response.status_code == 400
+        response = client.get('/testuser?per_page=%2B5')
+        assert response.status_code == 400
+        response = client.get('/testuser?page=%205%20')
+        assert response.status_code == 400
+        response = client.get('/testuser?page=' + '9' * 5000)
+        assert response.status_code == 400
+        assert 'error' in json.loads(response.data)
     
-    @patch('app.requests.get')
+    @patch('app.HTTP.request')
     def test_pagination_query_parameters(self, mock_get, client):
         """Test that pagination parameters are passed correctly."""
         mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = []
+        mock_response.status = 200
+        mock_response.headers = {}
+        mock_response.data = b'[]'
         mock_get.return_value = mock_response
         
         # Clear cache before test
-        fetch_user_gists.cache_clear()
+        cache_clear()
         
         response = client.get('/testuser?per_page=50&page=2')
         assert response.status_code == 200
@@ -186,17 +492,34 @@ class TestUserGistsEndpoint:
         data = json.loads(response.data)
         assert data['page'] == 2
         assert data['per_page'] == 50
+        mock_get.assert_called_once_with(
+            'GET',
+            'https://api.github.com/users/testuser/gists',
+            fields={'per_page': 50, 'page': 2},
+            headers=None
+        )
+        
+        # Compression is requested through the pool's default headers
+        accept_encoding = app_module.HTTP.headers['Accept-Encoding']
+        assert 'gzip' in accept_encoding
+        try:
+            import brotli  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            assert 'br' in accept_encoding
     
-    @patch('app.requests.get')
+    @patch('app.HTTP.request')
     def test_empty_gists_list(self, mock_get, client):
         """Test user with no gists."""
         mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = []
+        mock_response.status = 200
+        mock_response.headers = {}
+        mock_response.data = b'[]'
         mock_get.return_value = mock_response
         
         # Clear cache before test
-        fetch_user_gists.cache_clear()
+        cache_clear()
         
         response = client.get('/testuser')
         assert response.status_code == 200
@@ -206,12 +529,13 @@ class TestUserGistsEndpoint:
         assert len(data['gists']) == 0
         assert data['count'] == 0
     
-    @patch('app.requests.get')
+    @patch('app.HTTP.request')
     def test_gist_without_description(self, mock_get, client):
         """Test gist without description field."""
         mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = [
+        mock_response.status = 200
+        mock_response.headers = {}
+        mock_response.data = json.dumps([
             {
                 'id': 'abc123',
                 'public': True,
@@ -222,11 +546,11 @@ class TestUserGistsEndpoint:
                 'created_at': '2023-01-01T00:00:00Z',
                 'updated_at': '2023-01-02T00:00:00Z'
             }
-        ]
+        ]).encode()
         mock_get.return_value = mock_response
         
         # Clear cache before test
-        fetch_user_gists.cache_clear()
+        cache_clear()
         
         response = client.get('/testuser')
         assert response.status_code == 200
@@ -244,7 +568,7 @@ class TestIntegration:
         This test makes a real API call - may be slow or fail due to rate limits.
         """
         # Clear cache before test
-        fetch_user_gists.cache_clear()
+        cache_clear()
         
         response = client.get('/octocat')
         
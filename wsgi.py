@@ -0,0 +1,13 @@
+"""
+WSGI entrypoint for running the API under gunicorn with gevent workers.
+
+The standard library is monkey-patched before the app is imported so that
+GitHub and Redis calls yield to other requests instead of blocking the
+worker.
+"""
+
+from gevent import monkey
+
+monkey.patch_all()
+
+from app import app  # noqa: E402